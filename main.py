@@ -1,13 +1,296 @@
+import time
+BOOT_START = time.perf_counter()
+
 from ursina import *
+from panda3d.core import loadPrcFileData, ConfigVariableBool, ClockObject, GraphicsOutput, Texture, Filename, SamplerState
+from panda3d.core import BitMask32, PerspectiveLens, Camera as PandaCamera, OmniBoundingVolume
+from panda3d.core import Geom, GeomNode, GeomTriangles, GeomVertexArrayFormat, GeomVertexData, GeomVertexFormat, TransparencyAttrib
 from random import choice, uniform, randint
-import math, time, os
+import math, os, sys, json, random, argparse, shutil, subprocess, threading, queue, atexit, hashlib
+import numpy as np
+
+# Our own asset checks and reads go through asset_path() instead of the working
+# directory, so relative --capture/--replay paths still mean what the user typed.
+# Frozen (PyInstaller) builds keep their bundled data in sys._MEIPASS.
+FROZEN = getattr(sys, 'frozen', False)
+ASSET_DIR = sys._MEIPASS if FROZEN else os.path.dirname(os.path.abspath(__file__))
+
+def asset_path(path):
+    return os.path.join(ASSET_DIR, path)
+
+# ---------- Startup profile ----------
+startup_marks = [('python + imports', time.perf_counter())]   # (segment that just finished, time)
+startup_costs = {}   # deferred pool label -> seconds spent constructing it
+
+def mark_startup(label):
+    startup_marks.append((label, time.perf_counter()))
+
+def report_startup():
+    print(f'[startup] {"segment":<30} {"ms":>8}')
+    prev = BOOT_START
+    for label, t in startup_marks:
+        print(f'[startup] {label:<30} {(t - prev) * 1000:8.1f}')
+        prev = t
+    for label, cost in startup_costs.items():
+        print(f'[startup]   built {label:<24} {cost * 1000:8.1f}')
+    marks = dict(startup_marks)
+    print(f'[startup] time to interactive: {(marks["first frame"] - BOOT_START) * 1000:.1f} ms '
+          f'(from the first line of main.py; interpreter start-up not included)')
+    print(f'[startup] everything built:    {(marks["pools built"] - BOOT_START) * 1000:.1f} ms')
+
+def maybe_report_startup():
+    # Offscreen runs build every pool before the first frame, windowed runs after it,
+    # so report from whichever of the two happens last
+    marks = dict(startup_marks)
+    if ARGS.profile_startup and 'first frame' in marks and 'pools built' in marks:
+        report_startup()
+
+
+# ---------- Command line ----------
+def parse_resolution(value):
+    try:
+        w, h = (int(v) for v in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected WxH, e.g. 1280x720, got {value!r}')
+    if w <= 0 or h <= 0:
+        raise argparse.ArgumentTypeError(f'resolution must be positive, got {value!r}')
+    return w, h
+
+def positive_int(value):
+    try:
+        n = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected a whole number, got {value!r}')
+    if n <= 0:
+        raise argparse.ArgumentTypeError(f'must be positive, got {value!r}')
+    return n
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Miami Racer')
+    parser.add_argument('--capture', metavar='OUT',
+                        help='render offscreen at a fixed timestep and encode the frames to OUT with ffmpeg')
+    parser.add_argument('--bench', action='store_true',
+                        help='render offscreen at a fixed timestep and only report frame timings')
+    parser.add_argument('--seed', type=int, default=0, help='world seed for offscreen runs')
+    parser.add_argument('--frames', type=positive_int, default=1800, help='frames to render offscreen')
+    parser.add_argument('--fps', type=positive_int, default=60, help='fixed simulation/capture rate')
+    parser.add_argument('--resolution', type=parse_resolution, default='1280x720', help='offscreen resolution, WxH')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='JSON list of [frame, key] events to drive offscreen runs (default: autopilot bot)')
+    parser.add_argument('--latency', action='store_true',
+                        help='measure key-to-frame latency of lane changes and print a histogram on exit')
+    parser.add_argument('--low-latency', action='store_true',
+                        help='sample input right before the simulation, buffer lane changes, late-latch the camera')
+    parser.add_argument('--no-batch', action='store_true',
+                        help='draw every sprite as its own quad instead of batching them through the texture atlas')
+    parser.add_argument('--build-atlas', action='store_true', help='build the sprite atlas cache and exit')
+    parser.add_argument('--players', type=int, choices=range(1, 5), default=1,
+                        help='local split-screen players (1-4)')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print import and construction times once everything has been built')
+    args, _ = parser.parse_known_args(argv)
+    if args.capture:
+        if not shutil.which('ffmpeg'):
+            parser.error('--capture needs ffmpeg on PATH')
+    return args
+
+ARGS = parse_args(sys.argv[1:])
+OFFSCREEN = bool(ARGS.capture or ARGS.bench)
+LOW_LATENCY = ARGS.low_latency
+PLAYERS = ARGS.players
+
+if LOW_LATENCY:
+    # Present each frame as soon as it is rendered instead of at the start of the next one
+    loadPrcFileData('', 'auto-flip true')
+
+if OFFSCREEN:
+    random.seed(ARGS.seed)
+    loadPrcFileData('', f'win-size {ARGS.resolution[0]} {ARGS.resolution[1]}')
+    loadPrcFileData('', 'audio-library-name null')
+    loadPrcFileData('', 'sync-video false')
+    # No X server: fall back to EGL so Mesa's software rasterizer can still render
+    if sys.platform.startswith('linux') and not os.environ.get('DISPLAY'):
+        loadPrcFileData('', 'load-display p3headlessgl')
+
+
+# ---------- Texture atlas ----------
+# Billboard/HUD textures only: tiled textures (road, ocean, sky, buildings) rely on
+# texture wrapping and cannot live in an atlas.
+SPRITE_TEXTURES = [
+    'textures/car.png',
+    'textures/obstacle.png',
+    'textures/missile.png',
+    'textures/palm.png',
+    'textures/fire.png',
+    'textures/explosion.png',
+    'textures/nitro.png',
+]
+ATLAS_DIR         = asset_path('cache')   # prebuilt atlas (shipped with frozen builds)
+# Frozen builds may be installed read-only, so a rebuilt atlas goes to the user's home
+ATLAS_USER_DIR    = os.path.join(os.path.expanduser('~'), '.miami_racer', 'cache') if FROZEN else ATLAS_DIR
+ATLAS_PAGE_SIZE   = 2048
+ATLAS_MAX_SPRITE  = 512   # billboards never cover more screen than this
+ATLAS_PADDING     = 2
+ATLAS_LAYOUT      = 1     # bump when pack_atlas or the page format changes
+
+def pack_atlas(sizes):
+    # Shelf packer: tallest first, left to right, new shelf when a row is full,
+    # new page when a page is full. Returns {index: (page, x, y)}.
+    order = sorted(range(len(sizes)), key=lambda i: -sizes[i][1])
+    spots, page, x, y, shelf_h = {}, 0, 0, 0, 0
+    for i in order:
+        w, h = sizes[i][0] + ATLAS_PADDING*2, sizes[i][1] + ATLAS_PADDING*2
+        if x + w > ATLAS_PAGE_SIZE:
+            x, y, shelf_h = 0, y + shelf_h, 0
+        if y + h > ATLAS_PAGE_SIZE:
+            page, x, y, shelf_h = page + 1, 0, 0, 0
+        spots[i] = (page, x + ATLAS_PADDING, y + ATLAS_PADDING)
+        x += w
+        shelf_h = max(shelf_h, h)
+    return spots
+
+def build_atlas(paths=SPRITE_TEXTURES):
+    # Returns (page image paths, {texture path: (page, u0, v0, u1, v1)}), or None if
+    # Pillow is unavailable. Cached under a hash of the layout settings and source
+    # files, in ATLAS_DIR or ATLAS_USER_DIR; page file names in the cache are
+    # relative to the cache folder.
+    paths = [p for p in paths if os.path.exists(asset_path(p))]
+    digest = hashlib.sha1(f'{ATLAS_LAYOUT} {ATLAS_PAGE_SIZE} {ATLAS_MAX_SPRITE} {ATLAS_PADDING}'.encode())
+    for p in paths:
+        digest.update(p.encode())
+        with open(asset_path(p), 'rb') as f:
+            digest.update(f.read())
+    key = digest.hexdigest()[:16]
+    for cache_dir in dict.fromkeys((ATLAS_DIR, ATLAS_USER_DIR)):
+        meta_path = os.path.join(cache_dir, f'atlas_{key}.json')
+        if not os.path.exists(meta_path):
+            continue
+        with open(meta_path) as f:
+            meta = json.load(f)
+        page_paths = [os.path.join(cache_dir, page) for page in meta['pages']]
+        if all(os.path.exists(page) for page in page_paths):
+            return page_paths, {p: tuple(r) for p, r in meta['regions'].items()}
+
+    try:
+        from PIL import Image
+    except ImportError:
+        print('[atlas] Pillow not installed, sprites will not be batched')
+        return None
+
+    images = []
+    for p in paths:
+        im = Image.open(asset_path(p)).convert('RGBA')
+        im.thumbnail((ATLAS_MAX_SPRITE, ATLAS_MAX_SPRITE))
+        images.append(im)
+    spots = pack_atlas([im.size for im in images])
+    pages = [Image.new('RGBA', (ATLAS_PAGE_SIZE, ATLAS_PAGE_SIZE), (0, 0, 0, 0))
+             for _ in range(max((s[0] for s in spots.values()), default=-1) + 1)]
+    regions = {}
+    for i, (p, im) in enumerate(zip(paths, images)):
+        page, x, y = spots[i]
+        w, h = im.size
+        pages[page].paste(im, (x, y))
+        # Bleed the border pixels into the padding so filtering never samples a neighbour
+        pages[page].paste(im.crop((0, 0, w, 1)).resize((w, ATLAS_PADDING)), (x, y - ATLAS_PADDING))
+        pages[page].paste(im.crop((0, h-1, w, h)).resize((w, ATLAS_PADDING)), (x, y + h))
+        pages[page].paste(pages[page].crop((x, y - ATLAS_PADDING, x + 1, y + h + ATLAS_PADDING)).resize((ATLAS_PADDING, h + ATLAS_PADDING*2)), (x - ATLAS_PADDING, y - ATLAS_PADDING))
+        pages[page].paste(pages[page].crop((x + w - 1, y - ATLAS_PADDING, x + w, y + h + ATLAS_PADDING)).resize((ATLAS_PADDING, h + ATLAS_PADDING*2)), (x + w, y - ATLAS_PADDING))
+        # Image rows run top-down, texture v runs bottom-up
+        regions[p] = (page, x / ATLAS_PAGE_SIZE, 1 - (y + h) / ATLAS_PAGE_SIZE,
+                      (x + w) / ATLAS_PAGE_SIZE, 1 - y / ATLAS_PAGE_SIZE)
+
+    os.makedirs(ATLAS_USER_DIR, exist_ok=True)
+    page_names = [f'atlas_{key}_{i}.png' for i in range(len(pages))]
+    for name, im in zip(page_names, pages):
+        im.save(os.path.join(ATLAS_USER_DIR, name))
+    meta_path = os.path.join(ATLAS_USER_DIR, f'atlas_{key}.json')
+    with open(meta_path, 'w') as f:
+        json.dump({'pages': page_names, 'regions': regions}, f, indent=1)
+    print(f'[atlas] packed {len(paths)} textures into {len(pages)} page(s): {meta_path}')
+    return [os.path.join(ATLAS_USER_DIR, name) for name in page_names], regions
+
+if ARGS.build_atlas:
+    build_atlas()
+    sys.exit()
 
 
 # ---------- App / Window ----------
-app = Ursina(borderless=False)
+if OFFSCREEN:
+    app = Ursina(window_type='offscreen', size=ARGS.resolution, vsync=False)
+    # Offscreen buffers never send aspectRatioChanged, so size the UI lens ourselves
+    window.update_aspect_ratio()
+    window.editor_ui.enabled = False   # fps counter and debug buttons don't belong in footage
+else:
+    app = Ursina(borderless=False)
 window.title = 'Miami Racer'
 window.color = color.rgb(10, 15, 25)
-window.size = (1280, 720)  # helps avoid first-frame UI hiccups
+if not OFFSCREEN:
+    window.size = (1280, 720)  # helps avoid first-frame UI hiccups
+if LOW_LATENCY:
+    # Run our update after Panda's event manager (sort 0) so keys polled this frame are seen this frame
+    app._update_task.setSort(10)
+
+
+# ---------- Clock ----------
+# Gameplay timers read the frame clock rather than the wall clock so that
+# offscreen runs step at exactly 1/fps per frame and replay deterministically.
+game_clock = ClockObject.getGlobalClock()
+if OFFSCREEN:
+    game_clock.setMode(ClockObject.MNonRealTime)
+    game_clock.setFrameRate(ARGS.fps)
+    # The switch keeps the wall-clock time already elapsed; start every run from 0
+    game_clock.setFrameTime(0)
+
+def game_time():
+    return game_clock.getFrameTime()
+
+mark_startup('window')
+
+
+# ---------- Deferred construction ----------
+# Pools that are only needed once a run starts are built a few at a time per
+# frame behind the title screen; starting a run builds whatever is left.
+BOOT_FRAME_BUDGET = 0.004   # seconds per frame
+boot_queue = []   # [label, build fn, remaining count]
+
+def defer_build(label, fn, count=1):
+    boot_queue.append([label, fn, count])
+
+def run_boot_queue(budget=None):
+    start = time.perf_counter()
+    while boot_queue:
+        step = boot_queue[0]
+        t = time.perf_counter()
+        step[1]()
+        startup_costs[step[0]] = startup_costs.get(step[0], 0) + time.perf_counter() - t
+        step[2] -= 1
+        if step[2] <= 0:
+            boot_queue.pop(0)
+        if budget is not None and time.perf_counter() - start >= budget:
+            break
+
+def finish_boot():
+    if boot_queue:
+        run_boot_queue()
+        on_boot_done()
+
+def on_boot_done():
+    mark_startup('pools built')
+    maybe_report_startup()
+
+def boot_task(task):
+    if not boot_queue:
+        return task.done
+    run_boot_queue(BOOT_FRAME_BUDGET)
+    if not boot_queue:
+        on_boot_done()
+        return task.done
+    return task.cont
+
+def first_frame_task(task):
+    mark_startup('first frame')
+    maybe_report_startup()
+    return task.done
 
 
 # ---------- Settings ----------
@@ -36,6 +319,7 @@ OBSTACLE_MAX     = 0.75
 DIFFICULTY_RATE  = 0.03
 
 LANE_COOLDOWN    = 0.16
+LANE_QUEUE_MAX   = 3      # low-latency mode: lane presses held back by the cooldown
 RESPAWN_IFRAME   = 1.25
 
 # Missiles
@@ -80,7 +364,7 @@ SEED_BUILDINGS = [
 # ---------- Robust Sky ----------
 def make_sky():
     tex_path = 'textures/sky.png'
-    texture_ok = os.path.exists(tex_path)
+    texture_ok = os.path.exists(asset_path(tex_path))
     sky = Entity(model='sphere', scale=600, double_sided=True, unlit=True)
     sky.rotation = (0,0,0)
     if texture_ok:
@@ -103,40 +387,173 @@ sky = make_sky()
 ocean = Entity(model='plane', texture='textures/ocean.png', scale=(500,1,500),
                y=-0.05, color=color.white, texture_scale=(100,100), unlit=True)
 
+mark_startup('sky + ocean')
+
+
+# ---------- Sprite batching ----------
+# One interleaved vertex row: position, color, uv
+SPRITE_FORMAT = GeomVertexFormat.register_format(GeomVertexArrayFormat(
+    'vertex', 3, Geom.NT_float32, Geom.C_point,
+    'color', 4, Geom.NT_float32, Geom.C_color,
+    'texcoord', 2, Geom.NT_float32, Geom.C_texcoord))
+SPRITE_CORNERS = np.array([(-.5,-.5), (.5,-.5), (.5,.5), (-.5,.5)], dtype=np.float32)
+
+# Draws every sprite entity added to it as a quad in one GeomNode per atlas page,
+# rebuilt each frame from the entities' position, scale and color. The entities
+# keep their colliders and game logic; only their own model is dropped.
+# Refreshed from a task after the camera has moved (see refresh_sprite_batches).
+sprite_batches = []
+
+class SpriteBatch(Entity):
+    def __init__(self, atlas, billboard=True, view=camera, **kwargs):
+        super().__init__(**kwargs)
+        page_paths, self.regions = atlas
+        self.billboard_sprites = billboard
+        self.view = view
+        self.sprites = {}   # entity -> (page, u0, v0, u1, v1)
+        self.active = {}    # the enabled subset of sprites, kept by the entities' enable hooks
+        self.layers = []
+        sprite_batches.append(self)
+        for path in page_paths:
+            tex = app.loader.loadTexture(Filename.fromOsSpecific(path))
+            tex.setMinfilter(SamplerState.FT_linear)
+            tex.setMagfilter(SamplerState.FT_linear)
+            tex.setWrapU(SamplerState.WM_clamp)
+            tex.setWrapV(SamplerState.WM_clamp)
+            layer = self.attachNewNode(GeomNode('sprite_batch'))
+            # Vertices are rewritten in place every frame, so never cull and never recompute bounds
+            layer.node().setBounds(OmniBoundingVolume())
+            layer.node().setFinal(True)
+            layer.setTexture(tex)
+            layer.setTransparency(TransparencyAttrib.M_dual)
+            layer.setTwoSided(True)
+            layer.setLightOff()
+            self.layers.append({'np': layer, 'capacity': 0, 'vdata': None})
+
+    def add(self, entity, texture):
+        # Returns False (and leaves the entity drawing itself) if the texture isn't in the atlas
+        if texture not in self.regions:
+            return False
+        entity.model = None
+        region = self.regions[texture]
+        entity.on_enable = lambda: self.active.__setitem__(entity, region)
+        entity.on_disable = lambda: self.active.pop(entity, None)
+        entity.on_destroy = lambda: (self.sprites.pop(entity, None), self.active.pop(entity, None))
+        self.sprites[entity] = region
+        if entity.enabled:
+            self.active[entity] = region
+        return True
+
+    def allocate(self, layer, capacity):
+        vdata = GeomVertexData('sprites', SPRITE_FORMAT, Geom.UH_dynamic)
+        vdata.unclean_set_num_rows(capacity * 4)
+        tris = GeomTriangles(Geom.UH_static)
+        for i in range(capacity):
+            v = i * 4
+            tris.addVertices(v, v+1, v+2)
+            tris.addVertices(v+2, v+3, v)
+        geom = Geom(vdata)
+        geom.addPrimitive(tris)
+        node = layer['np'].node()
+        node.removeAllGeoms()
+        node.addGeom(geom)
+        layer['vdata'] = node.modifyGeom(0).modifyVertexData()
+        layer['capacity'] = capacity
+
+    def refresh(self):
+        # Sprites share the batch's parent, so a disabled ancestor hides the batch too
+        live = [[] for _ in self.layers]
+        for e, region in self.active.items():
+            live[region[0]].append((e, region))
+
+        if self.billboard_sprites:
+            right = np.array(self.getRelativeVector(self.view, Vec3(1,0,0)), dtype=np.float32)
+            up = np.array(self.getRelativeVector(self.view, Vec3(0,1,0)), dtype=np.float32)
+            eye = np.array(self.view.getPos(self), dtype=np.float32)
+        else:
+            right = np.array((1,0,0), dtype=np.float32)
+            up = np.array((0,1,0), dtype=np.float32)
+
+        for layer, sprites in zip(self.layers, live):
+            n = len(sprites)
+            if n > layer['capacity']:
+                self.allocate(layer, max(n, layer['capacity']*2, 16))
+            data = np.zeros((layer['capacity'], 4, 9), dtype=np.float32)
+            if n:
+                pos = np.array([tuple(e.getPos(self)) for e, _ in sprites], dtype=np.float32)
+                scale = np.array([tuple(e.getScale(self))[:2] for e, _ in sprites], dtype=np.float32)
+                tint = np.array([tuple(e.color) for e, _ in sprites], dtype=np.float32)
+                uv = np.array([r[1:] for _, r in sprites], dtype=np.float32)
+                if self.billboard_sprites:
+                    # back to front so blended edges composite correctly
+                    order = np.argsort(-((pos - eye)**2).sum(axis=1))
+                    pos, scale, tint, uv = pos[order], scale[order], tint[order], uv[order]
+                offset = SPRITE_CORNERS[None] * scale[:, None]
+                data[:n, :, 0:3] = pos[:, None] + offset[..., 0:1]*right + offset[..., 1:2]*up
+                data[:n, :, 3:7] = tint[:, None]
+                data[:n, 0, 7:9] = uv[:, (0, 1)]
+                data[:n, 1, 7:9] = uv[:, (2, 1)]
+                data[:n, 2, 7:9] = uv[:, (2, 3)]
+                data[:n, 3, 7:9] = uv[:, (0, 3)]
+            if layer['vdata'] is not None:
+                memoryview(layer['vdata'].modifyArray(0)).cast('B')[:] = memoryview(data).cast('B')
+
+def refresh_sprite_batches(task):
+    for batch in sprite_batches:
+        batch.refresh()
+    return task.cont
+
+atlas = None if ARGS.no_batch else build_atlas()
+mark_startup('atlas')
+
+def batch_sprite(batch, entity, texture):
+    if batch:
+        batch.add(entity, texture)
+    return entity
+
+
+# ---------- Split screen ----------
+# Viewport rectangles (left, right, bottom, top) per player count
+SPLIT_LAYOUTS = {
+    1: [(0, 1, 0, 1)],
+    2: [(0, 1, .5, 1), (0, 1, 0, .5)],
+    3: [(0, .5, .5, 1), (.5, 1, .5, 1), (0, .5, 0, .5)],
+    4: [(0, .5, .5, 1), (.5, 1, .5, 1), (0, .5, 0, .5), (.5, 1, 0, .5)],
+}
+
+SINGLE_PLAYER_KEYS = {'left': ('a', 'left arrow'), 'right': ('d', 'right arrow'), 'up': ('w',), 'down': ('s',),
+                      'nitro': ('n',), 'missile': ('m',)}
+SPLIT_KEYS = [
+    {'left': ('a',), 'right': ('d',), 'up': ('w',), 'down': ('s',), 'nitro': ('q',), 'missile': ('e',)},
+    {'left': ('left arrow',), 'right': ('right arrow',), 'up': ('up arrow',), 'down': ('down arrow',),
+     'nitro': ('right shift',), 'missile': ('right control',)},
+    {'left': ('j',), 'right': ('l',), 'up': ('i',), 'down': ('k',), 'nitro': ('u',), 'missile': ('o',)},
+    {'left': ('f',), 'right': ('h',), 'up': ('t',), 'down': ('g',), 'nitro': ('r',), 'missile': ('y',)},
+]
 
-# ---------- Player ----------
-player = Entity(
-    model='quad',
-    texture='textures/car.png',
-    color=color.white,
-    collider='box',
-    scale=(1.6, 1.0),
-    position=(0, 0.6, -3),
-    billboard=True,
-    double_sided=True
-)
-player.collider = BoxCollider(player, center=Vec3(0,0,0), size=Vec3(1.2,0.6,1.8))
-
-
-# ---------- Camera ----------
-camera.parent = None
-camera_target = Entity(position=(0, 2.7, -7.8))
-camera.position = camera_target.position
-camera.rotation = (11, 0, 0)
-camera.fov = 85
-
-def lane_to_x(idx): return (idx - 1) * LANE_OFFSET
-
-def update_camera(dt):
-    desired_pos = player.world_position + Vec3(0, 2.7, -7.8)
-    desired_pos.x += math.sin(time.time()*2.6) * 0.12
-    camera_target.position = lerp(camera_target.position, desired_pos, min(1, 4*dt))
-    camera.position = camera_target.position
-    camera.rotation_x = 11
-    camera.rotation_y = lerp(camera.rotation_y, (player.x - lane_to_x(target_lane))*-3, min(1, 3*dt))
-    camera.rotation_z = 0
-    target_fov = 85 + (speed-BASE_SPEED)*0.6 + (NITRO_FOV_BOOST if nitro_burning or unlimited_nitro else 0)
-    camera.fov = lerp(camera.fov, target_fov, 4*dt)
+# A 3D camera rendering into one viewport of the window, driven like ursina's camera
+class ViewCamera(Entity):
+    def __init__(self, region, mask):
+        super().__init__()
+        self.region = region
+        self.lens = PerspectiveLens()
+        self.lens.setNearFar(0.1, 10000)
+        node = PandaCamera('view_camera', self.lens)
+        node.setCameraMask(mask)
+        self.display_region = app.win.makeDisplayRegion(*region)
+        self.display_region.setCamera(self.attachNewNode(node))
+        self._fov = 85
+
+    @property
+    def fov(self):
+        return self._fov
+
+    @fov.setter
+    def fov(self, value):
+        self._fov = max(1, value)
+        l, r, b, t = self.region
+        self.lens.setAspectRatio(window.aspect_ratio * (r - l) / (t - b))
+        self.lens.setFov(self._fov)
 
 
 # ---------- Lighting ----------
@@ -145,8 +562,11 @@ DirectionalLight(direction=(1,-1,-0.5), color=color.rgb(255,220,200))
 
 
 # ---------- World builders ----------
-def make_road_tile(z_index):
+def lane_to_x(idx): return (idx - 1) * LANE_OFFSET
+
+def make_road_tile(race, z_index):
     tile = Entity(
+        parent=race.root,
         model='cube',
         texture='textures/road.png',
         collider=None,
@@ -161,34 +581,37 @@ def make_road_tile(z_index):
                position=(side*NUM_LANES*LANE_OFFSET*1.1, 0.01, 0), unlit=True)
     return tile
 
-def make_building(x, z):
+def make_building(race, x, z):
     tex = choice(SEED_BUILDINGS)
     s = uniform(1.2, 2.6)
     h = uniform(2.5, 6.0)
-    return Entity(model='cube', texture=tex, position=(x, h/2, z),
+    return Entity(parent=race.root, model='cube', texture=tex, position=(x, h/2, z),
                   scale=(s, h, s), collider=None, color=color.white)
 
-def make_palm(x, z):
-    return Entity(model='quad', texture='textures/palm.png', position=(x, 2, z),
-                  scale=(2.5, 4), double_sided=True, billboard=True)
+def make_palm(race, x, z):
+    return batch_sprite(race.sprites, Entity(parent=race.root, model='quad', texture='textures/palm.png',
+                                             position=(x, 2, z), scale=(2.5, 4), double_sided=True, billboard=True),
+                        'textures/palm.png')
 
-def make_obstacle():
-    e = Entity(model='quad', texture='textures/obstacle.png', color=color.white,
+def make_obstacle(race):
+    e = Entity(parent=race.root, model='quad', texture='textures/obstacle.png', color=color.white,
                position=(0, -99, 0), scale=(1.2, 1.2), collider='box',
                double_sided=True, billboard=True)
     e.collider = BoxCollider(e, center=Vec3(0,0,0), size=Vec3(1.0,1.0,1.2))
-    return e
+    return batch_sprite(race.sprites, e, 'textures/obstacle.png')
 
 
 # ---------- Nitro fire particles ----------
 class FirePuff(Entity):
-    def __init__(self):
+    def __init__(self, race):
         tex = 'textures/fire.png'
-        if not os.path.exists(tex):
+        if not os.path.exists(asset_path(tex)):
             tex = None
-        super().__init__(model='quad', texture=tex, scale=(0.5,0.5),
+        super().__init__(parent=race.root, model='quad', texture=tex, scale=(0.5,0.5),
                          color=color.rgba(255,180,80,200), position=(0,-99,0),
                          double_sided=True, billboard=True, unlit=True)
+        batch_sprite(race.sprites, self, tex)
+        self.race = race
         self.life = 0
         self.max_life = 0.4
         self.vel = Vec3(0,0,0)
@@ -211,28 +634,18 @@ class FirePuff(Entity):
         if self.life <= 0:
             self.active = False
             self.enabled = False
-            fire_pool.append(self)
-
-fire_pool = [FirePuff() for _ in range(50)]
-active_fire = []
-def spawn_fire():
-    if not (nitro_burning or unlimited_nitro) or not fire_pool:
-        return
-    back = player.world_position + Vec3(0, -0.1, -0.6)
-    puff = fire_pool.pop()
-    spread = Vec3(uniform(-0.2,0.2), uniform(-0.05,0.15), uniform(-0.2,0))
-    vel = Vec3(0, 2.0, -6.0) + spread
-    puff.ignite(back, vel, scale=uniform(0.45,0.75))
-    active_fire.append(puff)
+            self.race.fire_pool.append(self)
 
 
 # ---------- Explosion effect ----------
 class Explosion(Entity):
-    def __init__(self):
-        tex = 'textures/explosion.png' if os.path.exists('textures/explosion.png') else ('textures/fire.png' if os.path.exists('textures/fire.png') else None)
-        super().__init__(model='quad', texture=tex, position=(0,-99,0),
+    def __init__(self, race):
+        tex = 'textures/explosion.png' if os.path.exists(asset_path('textures/explosion.png')) else ('textures/fire.png' if os.path.exists(asset_path('textures/fire.png')) else None)
+        super().__init__(parent=race.root, model='quad', texture=tex, position=(0,-99,0),
                          scale=(1,1), color=color.rgba(255,200,120,255),
                          double_sided=True, billboard=True, unlit=True)
+        batch_sprite(race.sprites, self, tex)
+        self.race = race
         self.t = 0
         self.active = False
     def boom(self, pos):
@@ -250,25 +663,18 @@ class Explosion(Entity):
         if self.t >= EXPLOSION_TIME:
             self.active = False
             self.enabled = False
-            explosion_pool.append(self)
-
-explosion_pool = [Explosion() for _ in range(20)]
-active_explosions = []
-def spawn_explosion(pos):
-    if not explosion_pool: return
-    e = explosion_pool.pop()
-    e.boom(pos)
-    active_explosions.append(e)
-    play_explosion_sound()
+            self.race.explosion_pool.append(self)
 
 
 # ---------- Missiles ----------
 class Missile(Entity):
-    def __init__(self):
-        super().__init__(model='quad', texture='textures/missile.png' if os.path.exists('textures/obstacle.png') else None,
+    def __init__(self, race):
+        super().__init__(parent=race.root, model='quad', texture='textures/missile.png' if os.path.exists(asset_path('textures/obstacle.png')) else None,
                          color=color.rgba(160,220,255,255),
                          position=(0,-99,0), scale=(0.7,1.8), collider='box',
                          double_sided=True, billboard=True, unlit=True)
+        batch_sprite(race.sprites, self, 'textures/missile.png')
+        self.race = race
         self.speed = MISSILE_SPEED
         self.active = False
     def fire(self, pos):
@@ -278,238 +684,31 @@ class Missile(Entity):
     def step(self, dt):
         if not self.active:
             return
+        race = self.race
         self.z += self.speed * dt
-        hit = self.intersects().entities
+        hit = self.intersects(traverse_target=race.root).entities
         for h in hit:
-            if h in active_obstacles:
-                spawn_explosion(h.world_position)
+            if h in race.active_obstacles:
+                race.spawn_explosion(h.world_position)
                 h.enabled = False
-                active_obstacles.remove(h)
-                obstacle_pool.append(h)
+                race.active_obstacles.remove(h)
+                race.obstacle_pool.append(h)
                 self.reset()
                 break
-        if self.z > camera.z + 120:
+        if self.z > race.camera.z + 120:
             self.reset()
     def reset(self):
         self.active = False
         self.enabled = False
         self.position = (0,-99,0)
-        missile_pool.append(self)
-
-missile_pool = [Missile() for _ in range(MISSILE_POOL_SIZE)]
-active_missiles = []
-last_missile_time = 0
-
-def try_fire_missile():
-    global last_missile_time, missile_ammo, missile_regen_timer
-    now = time.time()
-    if now - last_missile_time < MISSILE_COOLDOWN:
-        return
-    if missile_ammo <= 0:
-        return
-    if not missile_pool:
-        return
-    m = missile_pool.pop()
-    spawn = player.world_position + Vec3(0, 0.2, 1.0)
-    m.fire(spawn)
-    active_missiles.append(m)
-    last_missile_time = now
-
-    # Consume ammo; update timer and HUD immediately
-    missile_ammo = max(0, missile_ammo - 1)
-    missile_regen_timer = 0.0
-    update_missile_icons()  # ensure HUD reflects the shot this frame
-
-    play_missile_sound()
-
-
-# ---------- World ----------
-tiles = [make_road_tile(i) for i in range(VISIBLE_TILES)]
-decor = []
-obstacle_pool = [make_obstacle() for _ in range(40)]
-active_obstacles = []
-
-def spawn_decor_around(z):
-    for side in (-1, 1):
-        for _ in range(randint(1, 2)):
-            x = side * SIDE_STRIP + uniform(-0.8, 0.8)
-            if uniform(0,1) < 0.6:
-                decor.append(make_building(x, z + uniform(-TILE_LENGTH/2, TILE_LENGTH/2)))
-            else:
-                decor.append(make_palm(x, z + uniform(-TILE_LENGTH/2, TILE_LENGTH/2)))
-
-def spawn_obstacle_at(z):
-    if not obstacle_pool:
-        return
-    lane = randint(0, NUM_LANES-1)
-    x = lane_to_x(lane)
-    e = obstacle_pool.pop()
-    e.position = (x, 0.6, z + uniform(-TILE_LENGTH/3, TILE_LENGTH/3))
-    e.enabled = True
-    active_obstacles.append(e)
-
-for i, t in enumerate(tiles):
-    spawn_decor_around(t.z)
-    if uniform(0,1) < OBSTACLE_BASE and i > 2:
-        spawn_obstacle_at(t.z)
-
-
-# ---------- HUD (text) ----------
-# Move score and speed to top-left (speed below score)
-score_text = Text(text='', parent=camera.ui, origin=(-.5,.5), position=(-.88,.45), scale=1, color=color.orange)
-speed_text = Text(text='', parent=camera.ui, origin=(-.5,.5), position=(-.88,.40), scale=1, color=color.azure)
-
-info_text = Text(text='A/D or Arrows: lanes | W/S: speed | N: nitro toggle | M: missile\nSpace: Start/Pause | Esc: Quit',
-                 parent=camera.ui, origin=(-.5,0), position=(-.88,.30), color=color.rgba(255,255,255,180))
-title_text = Text('MIAMI RACER', parent=camera.ui, origin=(0,0), y=.25, scale=2, color=color.color(30,1,0.9))
-press_text = Text('Press SPACE to start', parent=camera.ui, origin=(0,0), y=.1, color=color.rgba(255,180,200,210))
-
-# ---------- HUD (icons only) ----------
-# Missile icons (appear only when available; no regen bar)
-MISSILE_UI_Y = 0.33
-MISSILE_UI_SPACING = 0.08
-MISSILE_UI_SCALE = (0.06, 0.10)
-
-missile_icons = []
-def make_missile_icon(i):
-    x = (-0.16) + i*MISSILE_UI_SPACING
-    return Entity(parent=camera.ui, model='quad',
-                  texture='textures/missile.png' if os.path.exists('textures/missile.png') else None,
-                  position=(x, MISSILE_UI_Y), scale=MISSILE_UI_SCALE,
-                  color=color.rgba(255,255,255,0), unlit=True)
-
-for i in range(MISSILE_AMMO_MAX):
-    missile_icons.append(make_missile_icon(i))
-
-# Nitro icon (shows only when ready to be used)
-NITRO_UI_POS = (0.0, 0.40)
-NITRO_UI_SCALE = (0.07, 0.07)
-nitro_icon = Entity(parent=camera.ui, model='quad',
-                    texture='textures/nitro.png' if os.path.exists('textures/nitro.png') else None,
-                    position=NITRO_UI_POS, scale=NITRO_UI_SCALE,
-                    color=color.rgba(120, 255, 220, 0), unlit=True)
-
-
-# ---------- Game Vars ----------
-speed = BASE_SPEED
-target_lane = 1
-score = 0
-elapsed = 0
-game_over = False
-paused = True
-last_lane_change = 0
-invincible_until = 0
-
-# Nitro state
-nitro_charge = 1.0
-nitro_burning = False
-unlimited_nitro = False
-
-# Missile ammo state
-missile_ammo = MISSILE_AMMO_MAX
-missile_regen_timer = 0.0
-missile_regen_time_target = MISSILE_BASE_REGEN
-
-# UI readiness latch
-ui_ready = False
-
-
-def reset_run():
-    global speed, target_lane, score, elapsed, game_over, invincible_until
-    global nitro_charge, nitro_burning
-    global missile_ammo, missile_regen_timer, missile_regen_time_target
-
-    player.position = (0, 0.6, -3)
-    target_lane = 1
-    speed = BASE_SPEED
-    score = 0
-    elapsed = 0
-    game_over = False
-    invincible_until = time.time() + RESPAWN_IFRAME
-    nitro_charge = 1.0
-    nitro_burning = False
-
-    missile_ammo = MISSILE_AMMO_MAX
-    missile_regen_timer = 0.0
-    missile_regen_time_target = MISSILE_BASE_REGEN
-
-    for d in decor[:]:
-        destroy(d); decor.remove(d)
-    for o in active_obstacles[:]:
-        o.enabled = False; o.position = (0,-99,0)
-        active_obstacles.remove(o); obstacle_pool.append(o)
-    for f in active_fire[:]:
-        f.active = False; f.enabled = False
-        active_fire.remove(f); fire_pool.append(f)
-    for e in active_explosions[:]:
-        e.active = False; e.enabled = False
-        active_explosions.remove(e); explosion_pool.append(e)
-    for m in active_missiles[:]:
-        m.reset(); active_missiles.remove(m)
-
-    for i, t in enumerate(tiles):
-        t.z = i * TILE_LENGTH
-        spawn_decor_around(t.z)
-        if i > 2 and uniform(0,1) < OBSTACLE_BASE:
-            spawn_obstacle_at(t.z)
-
-    update_missile_icons()
-    update_nitro_icon()
-
-
-def toggle_pause():
-    global paused
-    paused = not paused
-    title_text.enabled = paused
-    press_text.enabled = paused
-    info_text.enabled = paused
-
-
-def input(key):
-    global target_lane, last_lane_change, paused, nitro_burning, nitro_charge, unlimited_nitro, game_over, score
-    if key == 'escape':
-        application.quit()
-
-    if key == 'space':
-        if paused:
-            toggle_pause()
-            if score == 0 and not game_over:
-                reset_run()
-        elif game_over:
-            toggle_pause()
-            reset_run()
-        else:
-            toggle_pause()
-
-    if paused or game_over:
-        return
-
-    now = time.time()
-    if now - last_lane_change >= LANE_COOLDOWN:
-        if key in ('a','left arrow'):
-            target_lane = max(0, target_lane-1); last_lane_change = now
-        if key in ('d','right arrow'):
-            target_lane = min(NUM_LANES-1, target_lane+1); last_lane_change = now
-
-    # Nitro toggle (N)
-    if key == 'n':
-        if not unlimited_nitro:
-            nitro_burning = not nitro_burning
-            if nitro_burning and nitro_charge <= 0:
-                nitro_charge = 1.0
-        else:
-            unlimited_nitro = False
-            nitro_burning = False
-        update_nitro_icon()
-
-    # Missiles
-    if key == 'm':
-        try_fire_missile()
+        self.race.missile_pool.append(self)
 
 
 # ---------- Audio helpers ----------
 def make_audio(path, loop=False, autoplay=False, volume=1.0):
-    if not os.path.exists(path):
+    if OFFSCREEN:
+        return None
+    if not os.path.exists(asset_path(path)):
         print(f'[audio] missing file: {path}')
         return None
     try:
@@ -521,24 +720,27 @@ def make_audio(path, loop=False, autoplay=False, volume=1.0):
 engine_audio  = make_audio(SND_ENGINE_FILE, loop=True, autoplay=False, volume=ENGINE_BASE_VOL)
 music_audio   = make_audio(SND_MUSIC_FILE,  loop=True, autoplay=True,  volume=MUSIC_VOL)
 
+def add_sfx(pool, path, volume):
+    a = make_audio(path, loop=False, autoplay=False, volume=volume)
+    if a: pool.append(a)
+
+# SFX pools are shared by every player
 missile_audio_pool = []
 MISSILE_SND_POOL_SIZE = 6
-if os.path.exists(SND_MISSILE_FILE):
-    for _ in range(MISSILE_SND_POOL_SIZE):
-        a = make_audio(SND_MISSILE_FILE, loop=False, autoplay=False, volume=MISSILE_VOL)
-        if a: missile_audio_pool.append(a)
+if os.path.exists(asset_path(SND_MISSILE_FILE)):
+    defer_build('missile sfx', lambda: add_sfx(missile_audio_pool, SND_MISSILE_FILE, MISSILE_VOL), MISSILE_SND_POOL_SIZE)
 
 explosion_audio_pool = []
 EXPLOSION_SND_POOL_SIZE = 6
-if os.path.exists(SND_EXPLODE_FILE):
-    for _ in range(EXPLOSION_SND_POOL_SIZE):
-        a = make_audio(SND_EXPLODE_FILE, loop=False, autoplay=False, volume=EXPLOSION_VOL)
-        if a: explosion_audio_pool.append(a)
+if os.path.exists(asset_path(SND_EXPLODE_FILE)):
+    defer_build('explosion sfx', lambda: add_sfx(explosion_audio_pool, SND_EXPLODE_FILE, EXPLOSION_VOL), EXPLOSION_SND_POOL_SIZE)
 
 if engine_audio:
     engine_audio.volume = 0.0
     engine_audio.play()
 
+mark_startup('lights + audio')
+
 def play_missile_sound():
     if not missile_audio_pool: return
     for a in missile_audio_pool:
@@ -560,169 +762,590 @@ def play_explosion_sound():
     except: pass
 
 
-# ---------- Helpers ----------
-def compute_missile_regen_time():
-    nitro_on = (nitro_burning or unlimited_nitro)
-    ceiling = min(MAX_SPEED * (NITRO_SPEED_MULT if nitro_on else 1.0), 1e9)
-    if ceiling <= BASE_SPEED + 1e-6:
-        return MISSILE_BASE_REGEN
-    norm = clamp((speed - BASE_SPEED) / max(1.0, (ceiling - BASE_SPEED)), 0, 1)
-    return max(MISSILE_REGEN_MIN, MISSILE_BASE_REGEN * (1.0 - 0.7*norm))
+# ---------- HUD layout ----------
+# Missile icons (appear only when available; no regen bar)
+MISSILE_UI_Y = 0.33
+MISSILE_UI_SPACING = 0.08
+MISSILE_UI_SCALE = (0.06, 0.10)
+
+# Nitro icon (shows only when ready to be used)
+NITRO_UI_POS = (0.0, 0.40)
+NITRO_UI_SCALE = (0.07, 0.07)
 
-def update_missile_icons():
-    for i in range(MISSILE_AMMO_MAX):
-        missile_icons[i].color = color.rgba(255,255,255,255 if i < missile_ammo else 0)
 
-def update_nitro_icon():
-    ready = (not nitro_burning) and (nitro_charge >= 1.0 or unlimited_nitro)
-    if nitro_icon.texture is None:
-        nitro_icon.color = color.rgba(0,0,0,0)
-        return
-    nitro_icon.color = color.rgba(120,255,220,230 if ready else 0)
+# ---------- Race ----------
+# Everything one player owns: car, camera, world pools, HUD and run state.
+# Races share textures, models and sounds but no game state, so each one
+# steps on its own. Single-player is one race filling the whole window.
+class Race:
+    def __init__(self, index, region, keys):
+        self.index = index
+        self.region = region
+        self.keys = keys
+        self.lane_keys = {**{k: -1 for k in keys['left']}, **{k: 1 for k in keys['right']}}
+
+        self.root = Entity()
+        if PLAYERS == 1:
+            self.camera = camera
+        else:
+            # Each viewport only sees its own world (sky, ocean and lights are shared)
+            mask = BitMask32.bit(index + 1)
+            self.root.hide(BitMask32.allOn() & ~mask)
+            self.camera = ViewCamera(region, mask)
+        self.sprites = SpriteBatch(atlas, view=self.camera, parent=self.root) if atlas else None
+
+        self.build_player()
+        self.build_camera()
+        self.build_world()
+        self.build_hud()
+        self.reset_state()
+
+    # ---------- Construction ----------
+    def build_player(self):
+        self.player = Entity(
+            parent=self.root,
+            model='quad',
+            texture='textures/car.png',
+            color=color.white,
+            collider='box',
+            scale=(1.6, 1.0),
+            position=(0, 0.6, -3),
+            billboard=True,
+            double_sided=True
+        )
+        self.player.collider = BoxCollider(self.player, center=Vec3(0,0,0), size=Vec3(1.2,0.6,1.8))
+        batch_sprite(self.sprites, self.player, 'textures/car.png')
+
+    def build_camera(self):
+        if self.camera is camera:
+            camera.parent = None
+        self.camera_target = Entity(position=(0, 2.7, -7.8))
+        self.camera.position = self.camera_target.position
+        self.camera.rotation = (11, 0, 0)
+        self.camera.fov = 85
+
+    def build_world(self):
+        self.tiles = [make_road_tile(self, i) for i in range(VISIBLE_TILES)]
+        self.decor = []
+        self.obstacle_pool = []   # filled before the first run, see defer_build below
+        self.active_obstacles = []
+        self.fire_pool = []
+        self.active_fire = []
+        self.explosion_pool = []
+        self.active_explosions = []
+        self.missile_pool = []
+        self.active_missiles = []
+
+        tag = f' p{self.index+1}' if PLAYERS > 1 else ''
+        defer_build('obstacles' + tag, lambda: self.obstacle_pool.append(make_obstacle(self)), 40)
+        defer_build('fire puffs' + tag, lambda: self.fire_pool.append(FirePuff(self)), 50)
+        defer_build('explosions' + tag, lambda: self.explosion_pool.append(Explosion(self)), 20)
+        defer_build('missiles' + tag, lambda: self.missile_pool.append(Missile(self)), MISSILE_POOL_SIZE)
+
+        for i, t in enumerate(self.tiles):
+            self.spawn_decor_around(t.z)
+            if uniform(0,1) < OBSTACLE_BASE and i > 2:
+                self.spawn_obstacle_at(t.z)
+
+    def build_hud(self):
+        # HUD is laid out for the full window and scaled down into this race's viewport
+        l, r, b, t = self.region
+        self.hud = Entity(parent=camera.ui, scale=min(r - l, t - b),
+                          position=(((l + r)/2 - .5) * window.aspect_ratio, (b + t)/2 - .5))
+        self.hud_sprites = SpriteBatch(atlas, billboard=False, parent=self.hud) if atlas else None
+
+        # Move score and speed to top-left (speed below score)
+        self.score_text = Text(text='', parent=self.hud, origin=(-.5,.5), position=(-.88,.45), scale=1, color=color.orange)
+        self.speed_text = Text(text='', parent=self.hud, origin=(-.5,.5), position=(-.88,.40), scale=1, color=color.azure)
+
+        if PLAYERS == 1:
+            info = 'A/D or Arrows: lanes | W/S: speed | N: nitro toggle | M: missile\nSpace: Start/Pause | Esc: Quit'
+            title = 'MIAMI RACER'
+        else:
+            k = {name: '/'.join(keys).upper() for name, keys in self.keys.items()}
+            info = (f"{k['left']} {k['right']}: lanes | {k['up']} {k['down']}: speed | "
+                    f"{k['nitro']}: nitro | {k['missile']}: missile\nSpace: Start/Pause/Retry | Esc: Quit")
+            title = f'PLAYER {self.index+1}'
+        self.info_text = Text(text=info, parent=self.hud, origin=(-.5,0), position=(-.88,.30),
+                              color=color.rgba(255,255,255,180))
+        self.title_text = Text(title, parent=self.hud, origin=(0,0), y=.25, scale=2, color=color.color(30,1,0.9))
+        self.press_text = Text('Press SPACE to start', parent=self.hud, origin=(0,0), y=.1, color=color.rgba(255,180,200,210))
+
+        self.missile_icons = [self.make_missile_icon(i) for i in range(MISSILE_AMMO_MAX)]
+        self.nitro_icon = Entity(parent=self.hud, model='quad',
+                                 texture='textures/nitro.png' if os.path.exists(asset_path('textures/nitro.png')) else None,
+                                 position=NITRO_UI_POS, scale=NITRO_UI_SCALE,
+                                 color=color.rgba(120, 255, 220, 0), unlit=True)
+        batch_sprite(self.hud_sprites, self.nitro_icon, 'textures/nitro.png')
+
+    def make_missile_icon(self, i):
+        x = (-0.16) + i*MISSILE_UI_SPACING
+        icon = Entity(parent=self.hud, model='quad',
+                      texture='textures/missile.png' if os.path.exists(asset_path('textures/missile.png')) else None,
+                      position=(x, MISSILE_UI_Y), scale=MISSILE_UI_SCALE,
+                      color=color.rgba(255,255,255,0), unlit=True)
+        return batch_sprite(self.hud_sprites, icon, 'textures/missile.png')
+
+    def force_ui_update_once(self):
+        for t in (self.score_text, self.speed_text, self.info_text, self.title_text, self.press_text):
+            if t: t.parent = self.hud
+        for e in self.missile_icons:
+            e.parent = e.parent
+        if self.nitro_icon: self.nitro_icon.parent = self.nitro_icon.parent
+        self.title_text.alpha = self.title_text.alpha
+
+    # ---------- Run state ----------
+    def reset_state(self):
+        self.speed = BASE_SPEED
+        self.target_lane = 1
+        self.score = 0
+        self.elapsed = 0
+        self.game_over = False
+        self.last_lane_change = 0
+        self.invincible_until = 0
+
+        # Nitro state
+        self.nitro_charge = 1.0
+        self.nitro_burning = False
+        self.unlimited_nitro = False
+
+        # Missile ammo state
+        self.missile_ammo = MISSILE_AMMO_MAX
+        self.missile_regen_timer = 0.0
+        self.missile_regen_time_target = MISSILE_BASE_REGEN
+        self.last_missile_time = 0
+
+        # Lane presses held back by the cooldown (low-latency mode): [(step, pressed_at)]
+        self.queued_lane_changes = []
+
+    def reset_run(self):
+        finish_boot()
+        self.reset_state()
+        self.player.position = (0, 0.6, -3)
+        self.invincible_until = game_time() + RESPAWN_IFRAME
+
+        for d in self.decor[:]:
+            destroy(d); self.decor.remove(d)
+        for o in self.active_obstacles[:]:
+            o.enabled = False; o.position = (0,-99,0)
+            self.active_obstacles.remove(o); self.obstacle_pool.append(o)
+        for f in self.active_fire[:]:
+            f.active = False; f.enabled = False
+            self.active_fire.remove(f); self.fire_pool.append(f)
+        for e in self.active_explosions[:]:
+            e.active = False; e.enabled = False
+            self.active_explosions.remove(e); self.explosion_pool.append(e)
+        for m in self.active_missiles[:]:
+            m.reset(); self.active_missiles.remove(m)
+
+        for i, t in enumerate(self.tiles):
+            t.z = i * TILE_LENGTH
+            self.spawn_decor_around(t.z)
+            if i > 2 and uniform(0,1) < OBSTACLE_BASE:
+                self.spawn_obstacle_at(t.z)
+
+        self.update_missile_icons()
+        self.update_nitro_icon()
+
+    def show_title(self, visible):
+        self.title_text.enabled = visible
+        self.press_text.enabled = visible
+        self.info_text.enabled = visible
+
+    # ---------- Spawning ----------
+    def spawn_decor_around(self, z):
+        for side in (-1, 1):
+            for _ in range(randint(1, 2)):
+                x = side * SIDE_STRIP + uniform(-0.8, 0.8)
+                if uniform(0,1) < 0.6:
+                    self.decor.append(make_building(self, x, z + uniform(-TILE_LENGTH/2, TILE_LENGTH/2)))
+                else:
+                    self.decor.append(make_palm(self, x, z + uniform(-TILE_LENGTH/2, TILE_LENGTH/2)))
+
+    def spawn_obstacle_at(self, z):
+        if not self.obstacle_pool:
+            return
+        lane = randint(0, NUM_LANES-1)
+        x = lane_to_x(lane)
+        e = self.obstacle_pool.pop()
+        e.position = (x, 0.6, z + uniform(-TILE_LENGTH/3, TILE_LENGTH/3))
+        e.enabled = True
+        self.active_obstacles.append(e)
+
+    def spawn_fire(self):
+        if not (self.nitro_burning or self.unlimited_nitro) or not self.fire_pool:
+            return
+        back = self.player.world_position + Vec3(0, -0.1, -0.6)
+        puff = self.fire_pool.pop()
+        spread = Vec3(uniform(-0.2,0.2), uniform(-0.05,0.15), uniform(-0.2,0))
+        vel = Vec3(0, 2.0, -6.0) + spread
+        puff.ignite(back, vel, scale=uniform(0.45,0.75))
+        self.active_fire.append(puff)
+
+    def spawn_explosion(self, pos):
+        if not self.explosion_pool: return
+        e = self.explosion_pool.pop()
+        e.boom(pos)
+        self.active_explosions.append(e)
+        play_explosion_sound()
+
+    def try_fire_missile(self):
+        now = game_time()
+        if now - self.last_missile_time < MISSILE_COOLDOWN:
+            return
+        if self.missile_ammo <= 0:
+            return
+        if not self.missile_pool:
+            return
+        m = self.missile_pool.pop()
+        spawn = self.player.world_position + Vec3(0, 0.2, 1.0)
+        m.fire(spawn)
+        self.active_missiles.append(m)
+        self.last_missile_time = now
+
+        # Consume ammo; update timer and HUD immediately
+        self.missile_ammo = max(0, self.missile_ammo - 1)
+        self.missile_regen_timer = 0.0
+        self.update_missile_icons()  # ensure HUD reflects the shot this frame
+
+        play_missile_sound()
+
+    # ---------- Input ----------
+    def change_lane(self, step, pressed_at):
+        lane = max(0, min(NUM_LANES-1, self.target_lane+step))
+        self.last_lane_change = game_time()
+        if lane != self.target_lane and latency_probe and latency_probe.race is self:
+            latency_probe.on_lane_change(pressed_at)
+        self.target_lane = lane
+
+    def input(self, key):
+        if self.game_over:
+            return
+
+        if key in self.lane_keys:
+            pressed_at = time.perf_counter()
+            if game_time() - self.last_lane_change >= LANE_COOLDOWN and not self.queued_lane_changes:
+                self.change_lane(self.lane_keys[key], pressed_at)
+            elif LOW_LATENCY and len(self.queued_lane_changes) < LANE_QUEUE_MAX:
+                self.queued_lane_changes.append((self.lane_keys[key], pressed_at))
+            elif latency_probe and latency_probe.race is self:
+                latency_probe.dropped += 1
+
+        # Nitro toggle
+        if key in self.keys['nitro']:
+            if not self.unlimited_nitro:
+                self.nitro_burning = not self.nitro_burning
+                if self.nitro_burning and self.nitro_charge <= 0:
+                    self.nitro_charge = 1.0
+            else:
+                self.unlimited_nitro = False
+                self.nitro_burning = False
+            self.update_nitro_icon()
+
+        # Missiles
+        if key in self.keys['missile']:
+            self.try_fire_missile()
+
+    # ---------- Helpers ----------
+    def compute_missile_regen_time(self):
+        nitro_on = (self.nitro_burning or self.unlimited_nitro)
+        ceiling = min(MAX_SPEED * (NITRO_SPEED_MULT if nitro_on else 1.0), 1e9)
+        if ceiling <= BASE_SPEED + 1e-6:
+            return MISSILE_BASE_REGEN
+        norm = clamp((self.speed - BASE_SPEED) / max(1.0, (ceiling - BASE_SPEED)), 0, 1)
+        return max(MISSILE_REGEN_MIN, MISSILE_BASE_REGEN * (1.0 - 0.7*norm))
+
+    def update_missile_icons(self):
+        for i in range(MISSILE_AMMO_MAX):
+            self.missile_icons[i].color = color.rgba(255,255,255,255 if i < self.missile_ammo else 0)
+
+    def update_nitro_icon(self):
+        ready = (not self.nitro_burning) and (self.nitro_charge >= 1.0 or self.unlimited_nitro)
+        if self.nitro_icon.texture is None:
+            self.nitro_icon.color = color.rgba(0,0,0,0)
+            return
+        self.nitro_icon.color = color.rgba(120,255,220,230 if ready else 0)
+
+    def update_camera(self, dt):
+        cam, player = self.camera, self.player
+        desired_pos = player.world_position + Vec3(0, 2.7, -7.8)
+        desired_pos.x += math.sin(game_time()*2.6) * 0.12
+        self.camera_target.position = lerp(self.camera_target.position, desired_pos, min(1, 4*dt))
+        cam.position = self.camera_target.position
+        cam.rotation_x = 11
+        cam.rotation_y = lerp(cam.rotation_y, (player.x - lane_to_x(self.target_lane))*-3, min(1, 3*dt))
+        cam.rotation_z = 0
+        target_fov = 85 + (self.speed-BASE_SPEED)*0.6 + (NITRO_FOV_BOOST if self.nitro_burning or self.unlimited_nitro else 0)
+        cam.fov = lerp(cam.fov, target_fov, 4*dt)
+
+    # ---------- Simulation ----------
+    def update(self):
+        # Pause/over: keep HUD updating
+        if paused or self.game_over:
+            self.update_missile_icons()
+            self.update_nitro_icon()
+            return
 
-def force_ui_update_once():
-    for t in (score_text, speed_text, info_text, title_text, press_text):
-        if t: t.parent = camera.ui
-    for e in missile_icons:
-        e.parent = e.parent
-    if nitro_icon: nitro_icon.parent = nitro_icon.parent
-    title_text.alpha = title_text.alpha
-    camera.ui.enabled = True
+        player = self.player
 
+        # Difficulty ramp
+        self.elapsed += time.dt
+        difficulty = 1.0 + DIFFICULTY_RATE * self.elapsed
+        target_max_speed = min(MAX_SPEED, BASE_SPEED + 22 * (difficulty - 1))
+        obstacle_chance = min(OBSTACLE_MAX, OBSTACLE_BASE * difficulty)
 
-# ---------- Update ----------
-def update():
-    global speed, score, elapsed, game_over, nitro_charge, nitro_burning
-    global missile_ammo, missile_regen_timer, missile_regen_time_target, ui_ready
+        # Nitro logic
+        if self.unlimited_nitro:
+            self.nitro_burning = True
+            self.nitro_charge = 1.0
+        else:
+            if self.nitro_burning:
+                self.nitro_charge = clamp(self.nitro_charge - NITRO_DECAY_RATE * time.dt, 0, 1)
+                if self.nitro_charge <= 0:
+                    self.nitro_burning = False
+            else:
+                self.nitro_charge = 1.0
+
+        # Speed control
+        w = 1.0 if any(held_keys.get(k, 0) for k in self.keys['up']) else 0.0
+        s = 1.0 if any(held_keys.get(k, 0) for k in self.keys['down']) else 0.0
+        forward = 1.0 + 0.55*w - 0.25*s
+
+        base_difficulty_speed = BASE_SPEED * (1.0 + (difficulty - 1))
+        ceiling = target_max_speed * (NITRO_SPEED_MULT if (self.nitro_burning or self.unlimited_nitro) else 1.0)
+        desired_unclamped = base_difficulty_speed * forward
+        desired = clamp(desired_unclamped, BASE_SPEED, ceiling)
+
+        accel_factor = ACCEL * (1.8 if (self.nitro_burning or self.unlimited_nitro) else 1.0)
+        self.speed += (desired - self.speed) * min(1, accel_factor * time.dt)
+
+        # Buffered lane presses fire one per cooldown, in the order they were made
+        if self.queued_lane_changes and game_time() - self.last_lane_change >= LANE_COOLDOWN:
+            self.change_lane(*self.queued_lane_changes.pop(0))
+
+        # Car movement/tilt
+        target_x = lane_to_x(self.target_lane)
+        player.x = lerp(player.x, target_x, 1 - pow(1 - min(1, TURN_LERP * time.dt), 1))
+        skew = clamp((player.x - target_x) * -0.1, -0.15, 0.15)
+        player.scale_x = 1.6 * (1 + skew)
+        if latency_probe and latency_probe.race is self:
+            latency_probe.on_sim()
+
+        # Nitro fire
+        # if self.nitro_burning or self.unlimited_nitro:
+        #     for _ in range(2 + int(self.speed/35)):
+                # self.spawn_fire()
+
+        # Step effects
+        for f in self.active_fire[:]:
+            f.step(time.dt)
+            if not f.active: self.active_fire.remove(f)
+        for e in self.active_explosions[:]:
+            e.step(time.dt)
+            if not e.active: self.active_explosions.remove(e)
+        for m in self.active_missiles[:]:
+            m.step(time.dt)
+            if not m.active: self.active_missiles.remove(m)
+
+        # Missile regen (icons pop in)
+        if self.missile_ammo < MISSILE_AMMO_MAX:
+            self.missile_regen_time_target = self.compute_missile_regen_time()
+            self.missile_regen_timer += time.dt
+            if self.missile_regen_timer >= self.missile_regen_time_target:
+                self.missile_ammo = min(MISSILE_AMMO_MAX, self.missile_ammo + 1)
+                self.missile_regen_timer = 0.0
+                self.missile_regen_time_target = self.compute_missile_regen_time()
+
+        # World scroll
+        dz = self.speed * time.dt
+        for t in self.tiles: t.z -= dz
+        for d in self.decor: d.z -= dz
+        for o in self.active_obstacles: o.z -= dz
+
+        # Recycle and spawn
+        far_ahead_z = max(t.z for t in self.tiles)
+        for t in self.tiles:
+            if t.z < player.z - TILE_LENGTH:
+                t.z = far_ahead_z + TILE_LENGTH
+                far_ahead_z = t.z
+                self.spawn_decor_around(t.z)
+                if uniform(0,1) < obstacle_chance:
+                    self.spawn_obstacle_at(t.z)
+
+        # Cull behind
+        min_keep_z = player.z - TILE_LENGTH*3
+        for d in self.decor[:]:
+            if d.z < min_keep_z:
+                destroy(d); self.decor.remove(d)
+        for o in self.active_obstacles[:]:
+            if o.z < min_keep_z:
+                o.enabled = False; o.position = (0,-99,0)
+                self.active_obstacles.remove(o); self.obstacle_pool.append(o)
+
+        # Collision with obstacles (i-frames)
+        if game_time() >= self.invincible_until:
+            hit = player.intersects(traverse_target=self.root).entities
+            if any(e in self.active_obstacles for e in hit):
+                # CRASH: show explosion and sound at player, then game over
+                self.spawn_explosion(player.world_position)
+                play_explosion_sound()
+                self.game_over = True
+                self.title_text.text = 'CRASH!'
+                self.press_text.text = 'Press SPACE to retry'
+                self.title_text.enabled = True
+                self.press_text.enabled = True
+                self.info_text.enabled = False
+
+        # HUD: score (left) and speed below it
+        self.score += self.speed * time.dt
+        self.score_text.text = f'Score: {int(self.score)}'
+        self.speed_text.text = f'{int(self.speed)} km/h'
+
+        # Update icons
+        self.update_missile_icons()
+        self.update_nitro_icon()
 
-    if not ui_ready:
-        force_ui_update_once()
-        ui_ready = True
 
-    update_camera(time.dt)
+# ---------- Game Vars ----------
+paused = True
+
+# UI readiness latch
+ui_ready = False
+
+if PLAYERS > 1:
+    camera.display_region.setActive(False)   # every race renders through its own viewport
+races = [Race(i, region, SINGLE_PLAYER_KEYS if PLAYERS == 1 else SPLIT_KEYS[i])
+         for i, region in enumerate(SPLIT_LAYOUTS[PLAYERS])]
+
+mark_startup('races (car, road, decor, hud)')
+
+
+# ---------- Input latency ----------
+LATENCY_BUCKET_MS = 4
+
+# Follows each lane change from key press, through the simulation step that
+# moves the car, to the first rendered frame showing the car in a new place.
+# Press times are taken when the key reaches input(), so OS/driver queueing
+# before Panda polls the device is not included. Measures the first race only.
+# The frame time is taken once the frame has been flipped: with auto-flip right
+# after igLoop renders it, otherwise Panda flips it at the start of the next
+# frame's igLoop, so the sample waits for the next post-render task (an upper
+# bound that also includes rendering that next frame).
+class LatencyProbe:
+    def __init__(self, race):
+        self.race = race
+        self.flip_delay = 0 if ConfigVariableBool('auto-flip', False).getValue() else 1
+        self.pending = []
+        self.samples = []   # (key->sim ms, key->frame ms, frames)
+        self.dropped = 0
+
+    def on_lane_change(self, pressed_at):
+        self.pending.append({'pressed_at': pressed_at, 'frame': game_clock.getFrameCount(),
+                             'x': self.race.player.x, 'sim_at': None})
+
+    def on_sim(self):
+        now = time.perf_counter()
+        for p in self.pending:
+            if p['sim_at'] is None and self.race.player.x != p['x']:
+                p['sim_at'] = now
+                p['flips_left'] = self.flip_delay
+
+    def on_frame(self, task):
+        now = time.perf_counter()
+        for p in self.pending[:]:
+            if p['sim_at'] is None:
+                continue
+            if p['flips_left']:
+                p['flips_left'] -= 1
+            else:
+                self.samples.append(((p['sim_at'] - p['pressed_at']) * 1000,
+                                     (now - p['pressed_at']) * 1000,
+                                     game_clock.getFrameCount() - p['frame']))
+                self.pending.remove(p)
+        return task.cont
+
+    def report(self):
+        print(f'[latency] {len(self.samples)} lane changes, {self.dropped} presses dropped by the cooldown')
+        if not self.samples:
+            return
+        to_sim = [s[0] for s in self.samples]
+        to_frame = sorted(s[1] for s in self.samples)
+        p95 = to_frame[min(len(to_frame) - 1, int(len(to_frame) * 0.95))]
+        print(f'[latency] key->sim avg {sum(to_sim) / len(to_sim):.1f} ms | '
+              f'key->frame avg {sum(to_frame) / len(to_frame):.1f} ms, p95 {p95:.1f}, max {to_frame[-1]:.1f} | '
+              f'avg {sum(s[2] for s in self.samples) / len(self.samples):.2f} frames')
+        buckets = {}
+        for ms in to_frame:
+            b = int(ms // LATENCY_BUCKET_MS)
+            buckets[b] = buckets.get(b, 0) + 1
+        peak = max(buckets.values())
+        for b in range(min(buckets), max(buckets) + 1):
+            n = buckets.get(b, 0)
+            print(f'  {b * LATENCY_BUCKET_MS:4d}-{(b + 1) * LATENCY_BUCKET_MS:<4d} ms | '
+                  f'{"#" * max(n and 1, round(40 * n / peak))} {n or ""}')
+
+latency_probe = LatencyProbe(races[0]) if ARGS.latency else None
+
 
-    # Pause/over: fade engine, duck music, keep HUD updating
-    if paused or game_over:
+def toggle_pause():
+    global paused
+    paused = not paused
+    for race in races:
+        race.show_title(paused)
+
+
+def input(key):
+    if key == 'escape':
+        application.quit()
+
+    if key == 'space':
+        crashed = [r for r in races if r.game_over]
+        if paused:
+            toggle_pause()
+            for race in races:
+                if race.score == 0 and not race.game_over:
+                    race.reset_run()
+        elif crashed and len(crashed) == len(races):
+            toggle_pause()
+            for race in races:
+                race.reset_run()
+        elif crashed:
+            # Split screen: crashed players rejoin while the others keep racing
+            for race in crashed:
+                race.reset_run()
+                race.show_title(False)
+        else:
+            toggle_pause()
+
+    if paused:
+        return
+
+    for race in races:
+        race.input(key)
+
+
+# ---------- Engine audio ----------
+def update_engine_audio():
+    # Pause/over: fade engine, duck music
+    racing = [r for r in races if not r.game_over]
+    if paused or not racing:
         if engine_audio:
             engine_audio.volume = lerp(engine_audio.volume, 0.0, min(1, 6*time.dt))
         if music_audio:
             music_audio.volume = lerp(music_audio.volume, MUSIC_DUCK_VOL, min(1, 3*time.dt))
-        update_missile_icons()
-        update_nitro_icon()
         return
     else:
         if music_audio:
             music_audio.volume = lerp(music_audio.volume, MUSIC_VOL, min(1, 3*time.dt))
 
-    # Difficulty ramp
-    elapsed += time.dt
-    difficulty = 1.0 + DIFFICULTY_RATE * elapsed
-    target_max_speed = min(MAX_SPEED, BASE_SPEED + 22 * (difficulty - 1))
-    obstacle_chance = min(OBSTACLE_MAX, OBSTACLE_BASE * difficulty)
-
-    # Nitro logic
-    if unlimited_nitro:
-        nitro_burning = True
-        nitro_charge = 1.0
-    else:
-        if nitro_burning:
-            nitro_charge = clamp(nitro_charge - NITRO_DECAY_RATE * time.dt, 0, 1)
-            if nitro_charge <= 0:
-                nitro_burning = False
-        else:
-            nitro_charge = 1.0
-
-    # Speed control
-    w = 1.0 if held_keys.get('w', 0) else 0.0
-    s = 1.0 if held_keys.get('s', 0) else 0.0
-    forward = 1.0 + 0.55*w - 0.25*s
-
-    base_difficulty_speed = BASE_SPEED * (1.0 + (difficulty - 1))
-    ceiling = target_max_speed * (NITRO_SPEED_MULT if (nitro_burning or unlimited_nitro) else 1.0)
-    desired_unclamped = base_difficulty_speed * forward
-    desired = clamp(desired_unclamped, BASE_SPEED, ceiling)
-
-    accel_factor = ACCEL * (1.8 if (nitro_burning or unlimited_nitro) else 1.0)
-    speed += (desired - speed) * min(1, accel_factor * time.dt)
-
-    # Car movement/tilt
-    target_x = lane_to_x(target_lane)
-    player.x = lerp(player.x, target_x, 1 - pow(1 - min(1, TURN_LERP * time.dt), 1))
-    skew = clamp((player.x - target_x) * -0.1, -0.15, 0.15)
-    player.scale_x = 1.6 * (1 + skew)
-
-    # Nitro fire
-    # if nitro_burning or unlimited_nitro:
-    #     for _ in range(2 + int(speed/35)):
-            # spawn_fire()
-
-    # Step effects
-    for f in active_fire[:]:
-        f.step(time.dt)
-        if not f.active: active_fire.remove(f)
-    for e in active_explosions[:]:
-        e.step(time.dt)
-        if not e.active: active_explosions.remove(e)
-    for m in active_missiles[:]:
-        m.step(time.dt)
-        if not m.active: active_missiles.remove(m)
-
-    # Missile regen (icons pop in)
-    if missile_ammo < MISSILE_AMMO_MAX:
-        missile_regen_time_target = compute_missile_regen_time()
-        missile_regen_timer += time.dt
-        if missile_regen_timer >= missile_regen_time_target:
-            missile_ammo = min(MISSILE_AMMO_MAX, missile_ammo + 1)
-            missile_regen_timer = 0.0
-            missile_regen_time_target = compute_missile_regen_time()
-
-    # World scroll
-    dz = speed * time.dt
-    for t in tiles: t.z -= dz
-    for d in decor: d.z -= dz
-    for o in active_obstacles: o.z -= dz
-
-    # Recycle and spawn
-    far_ahead_z = max(t.z for t in tiles)
-    for t in tiles:
-        if t.z < player.z - TILE_LENGTH:
-            t.z = far_ahead_z + TILE_LENGTH
-            far_ahead_z = t.z
-            spawn_decor_around(t.z)
-            if uniform(0,1) < obstacle_chance:
-                spawn_obstacle_at(t.z)
-
-    # Cull behind
-    min_keep_z = player.z - TILE_LENGTH*3
-    for d in decor[:]:
-        if d.z < min_keep_z:
-            destroy(d); decor.remove(d)
-    for o in active_obstacles[:]:
-        if o.z < min_keep_z:
-            o.enabled = False; o.position = (0,-99,0)
-            active_obstacles.remove(o); obstacle_pool.append(o)
-
-    # Collision with obstacles (i-frames)
-    if time.time() >= invincible_until:
-        hit = player.intersects().entities
-        if any(e in active_obstacles for e in hit):
-            # CRASH: show explosion and sound at player, then game over
-            spawn_explosion(player.world_position)
-            play_explosion_sound()
-            game_over = True
-            title_text.text = 'CRASH!'
-            press_text.text = 'Press SPACE to retry'
-            title_text.enabled = True
-            press_text.enabled = True
-            info_text.enabled = False
-
-    # Engine audio with nitro bump
+    # Engine audio with nitro bump; one shared loop follows the fastest car
     if engine_audio:
-        nitro_on = (nitro_burning or unlimited_nitro)
+        lead = max(racing, key=lambda r: r.speed)
+        nitro_on = (lead.nitro_burning or lead.unlimited_nitro)
         ceiling_for_audio = min(MAX_SPEED * (NITRO_SPEED_MULT if nitro_on else 1.0), 1e9)
         norm = 0.0
         if ceiling_for_audio > 0:
-            norm = clamp((speed - BASE_SPEED) / max(1.0, (ceiling_for_audio - BASE_SPEED)), 0, 1)
+            norm = clamp((lead.speed - BASE_SPEED) / max(1.0, (ceiling_for_audio - BASE_SPEED)), 0, 1)
         base_pitch = ENGINE_BASE_PITCH + (ENGINE_MAX_PITCH - ENGINE_BASE_PITCH) * pow(norm, 0.85)
         if nitro_on:
             base_pitch += ENGINE_NITRO_PITCH_BUMP
@@ -735,34 +1358,232 @@ def update():
         try: music_audio.play()
         except: pass
 
-    # HUD: score (left) and speed below it
-    score += speed * time.dt
-    score_text.text = f'Score: {int(score)}'
-    speed_text.text = f'{int(speed)} km/h'
 
-    # Update icons
-    update_missile_icons()
-    update_nitro_icon()
+# ---------- Update ----------
+def update():
+    global ui_ready
+
+    if not ui_ready:
+        for race in races:
+            race.force_ui_update_once()
+        camera.ui.enabled = True
+        ui_ready = True
+
+    if OFFSCREEN:
+        offscreen_driver.step()
+
+    for race in races:
+        if not LOW_LATENCY:
+            race.update_camera(time.dt)
+        race.update()
+
+    update_engine_audio()
+
+
+# ---------- Offscreen driver (replay / autopilot) ----------
+# Feeds keys into the game each simulation step, from a replay file or a simple bot.
+class OffscreenDriver:
+    def __init__(self, replay_path=None):
+        self.frame = 0
+        self.events = {}
+        self.crashed_at = {}   # race -> frame it crashed on
+        if replay_path:
+            with open(replay_path) as f:
+                for frame, key in json.load(f):
+                    self.events.setdefault(int(frame), []).append(key)
+
+    def press(self, key):
+        # Same path as a real key press, so held_keys and input() both see it
+        app.input(key, True)
+
+    def tap(self, key):
+        self.press(key)
+        self.press(f'{key} up')
+
+    def step(self):
+        if self.events:
+            for key in self.events.get(self.frame, ()):
+                self.press(key)
+        else:
+            self.autopilot()
+        self.frame += 1
+
+    def autopilot(self):
+        # One space restarts every crashed race, so forget all of them once they're back
+        for race in [r for r in self.crashed_at if not r.game_over]:
+            del self.crashed_at[race]
+        if self.frame == 0:
+            for race in races:
+                self.press(race.keys['up'][0])
+        if paused:
+            self.tap('space')
+            return
+        for race in races:
+            self.steer(race)
+
+    def steer(self, race):
+        keys = race.keys
+        if race.game_over:
+            if race not in self.crashed_at:
+                self.crashed_at[race] = self.frame
+            elif self.frame - self.crashed_at[race] > ARGS.fps * 1.5:
+                del self.crashed_at[race]
+                self.tap('space')
+            return
+        if self.frame % (ARGS.fps * 8) == ARGS.fps * 4:
+            self.tap(keys['nitro'][0])
+
+        ahead = [o for o in race.active_obstacles if 0 < o.z - race.player.z < 16]
+        blocked = {int(round(o.x / LANE_OFFSET)) + 1 for o in ahead}
+        if race.target_lane not in blocked:
+            return
+        for lane, key in ((race.target_lane - 1, keys['left'][0]), (race.target_lane + 1, keys['right'][0])):
+            if 0 <= lane < NUM_LANES and lane not in blocked:
+                self.tap(key)
+                return
+        self.tap(keys['missile'][0])
+
+
+# ---------- Offscreen capture ----------
+# Reads each rendered frame back into RAM and streams it to an ffmpeg worker process.
+# Frames are copied into one of two buffers and written to the pipe by a writer
+# thread, so the next frame renders while the previous one is being encoded. Without an output path (--bench) frames are still read back but discarded, which
+# makes the run a render/readback timing harness that needs no GPU.
+class FrameCapture:
+    def __init__(self, out_path, frames, fps):
+        self.out_path = out_path
+        self.frames = frames
+        self.fps = fps
+        self.count = 0
+        self.encoder = None
+        self.writer = None
+        self.write_error = None
+        self.free = queue.Queue()     # buffers the render loop may fill
+        self.filled = queue.Queue()   # buffers waiting for the writer, None to stop
+        self.frame_times = []
+        self.started = None
+        self.last = None
+        # Panda copies the color buffer into the texture's RAM image after every render
+        self.tex = Texture('capture')
+        app.win.addRenderTexture(self.tex, GraphicsOutput.RTMCopyRam)
+
+    def start_encoder(self):
+        w, h = self.tex.getXSize(), self.tex.getYSize()
+        pix_fmt = 'bgra' if self.tex.getNumComponents() == 4 else 'bgr24'
+        cmd = [shutil.which('ffmpeg'), '-loglevel', 'error', '-y',
+               '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-s', f'{w}x{h}', '-r', str(self.fps), '-i', '-',
+               '-vf', 'vflip', '-pix_fmt', 'yuv420p', self.out_path]
+        self.encoder = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        for _ in range(2):
+            self.free.put(bytearray(w * h * self.tex.getNumComponents()))
+        self.writer = threading.Thread(target=self.write_frames, daemon=True)
+        self.writer.start()
+
+    def write_frames(self):
+        # Pipe writes release the GIL, so this overlaps with rendering the next frame
+        while True:
+            buf = self.filled.get()
+            if buf is None:
+                break
+            if not self.write_error:
+                try:
+                    self.encoder.stdin.write(buf)
+                except OSError as e:   # BrokenPipeError when ffmpeg has exited
+                    self.write_error = e
+            self.free.put(buf)
+        try:
+            self.encoder.stdin.close()
+        except OSError as e:
+            self.write_error = self.write_error or e
+
+    def step(self, task):
+        if not self.tex.hasRamImage():
+            return task.cont
+        now = time.perf_counter()
+        if self.started is None:
+            self.started = now
+            if self.out_path:
+                self.start_encoder()
+        else:
+            self.frame_times.append(now - self.last)
+        self.last = now
+
+        if self.encoder:
+            if self.write_error or self.encoder.poll() is not None:
+                self.fail(self.stop_encoder())
+            buf = self.free.get()   # waits only if ffmpeg is two frames behind
+            buf[:] = memoryview(self.tex.getRamImage())
+            self.filled.put(buf)
+        self.count += 1
+        if self.count >= self.frames:
+            self.finish()
+            return task.done
+        return task.cont
+
+    def stop_encoder(self):
+        self.filled.put(None)
+        self.writer.join()
+        return self.encoder.wait()
+
+    def fail(self, status):
+        sys.exit(f'[capture] ffmpeg exited with status {status} after {self.count} frames'
+                 + (f' ({self.write_error})' if self.write_error else ''))
+
+    def finish(self):
+        if self.encoder:
+            status = self.stop_encoder()
+            if status != 0 or self.write_error:
+                self.fail(status)
+        self.report()
+        application.quit()
+
+    def report(self):
+        wall = max(1e-9, self.last - self.started)
+        ms = sorted(t * 1000 for t in self.frame_times) or [0.0]
+        p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+        print(f'[capture] {self.count} frames at {self.tex.getXSize()}x{self.tex.getYSize()} in {wall:.2f}s '
+              f'-> {self.count / wall:.1f} fps, {(self.count / self.fps) / wall:.2f}x real time')
+        print(f'[capture] frame ms: avg {sum(ms) / len(ms):.2f} | p95 {p95:.2f} | max {ms[-1]:.2f}')
+        if self.out_path:
+            print(f'[capture] wrote {self.out_path}')
 
 
 # ---------- Boot overlays ----------
-speed = BASE_SPEED
-target_lane = 1
-score = 0
-elapsed = 0
-game_over = False
 paused = True
-last_lane_change = 0
-invincible_until = 0
-nitro_charge = 1.0
-nitro_burning = False
-unlimited_nitro = False
 
 # Ensure UI visible at boot
-title_text.enabled = True
-press_text.enabled = True
-info_text.enabled = True
-score_text.enabled = True
-speed_text.enabled = True
+for race in races:
+    race.show_title(True)
+    race.score_text.enabled = True
+    race.speed_text.enabled = True
+
+if LOW_LATENCY:
+    # Late-latch: move the cameras after the simulation, right before igLoop (50) renders
+    def late_latch_camera(task):
+        for race in races:
+            race.update_camera(time.dt)
+        return task.cont
+    app.taskMgr.add(late_latch_camera, 'late_latch_camera', sort=48)
+
+# Billboards face the camera's final position for this frame: after the update
+# task and the late-latch (48), before igLoop (50) renders
+app.taskMgr.add(refresh_sprite_batches, 'sprite_batches', sort=49)
+
+if latency_probe:
+    app.taskMgr.add(latency_probe.on_frame, 'latency_probe', sort=55)  # after igLoop (50) has rendered
+    atexit.register(latency_probe.report)
+
+mark_startup('boot overlays')
+app.taskMgr.add(first_frame_task, 'first_frame', sort=60)   # after igLoop (50) has rendered
+app.taskMgr.add(boot_task, 'boot_pools')
+
+if OFFSCREEN:
+    offscreen_driver = OffscreenDriver(ARGS.replay)
+    frame_capture = FrameCapture(ARGS.capture, ARGS.frames, ARGS.fps)
+    app.taskMgr.add(frame_capture.step, 'frame_capture', sort=60)  # after igLoop (50) has rendered
+    if not ARGS.replay:
+        toggle_pause()
+        for race in races:
+            race.reset_run()
 
 app.run()
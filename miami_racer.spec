@@ -0,0 +1,24 @@
+# PyInstaller build:  python main.py --build-atlas && pyinstaller miami_racer.spec
+#
+# One-folder build, so nothing is unpacked to a temp dir on every launch.
+# Bytecode is compiled once at build time (optimize=2) and the prebuilt
+# sprite atlas ships in cache/, so the first launch doesn't pack it.
+from PyInstaller.utils.hooks import collect_data_files
+
+a = Analysis(
+    ['main.py'],
+    datas=[('textures', 'textures'), ('sounds', 'sounds'), ('cache', 'cache')] + collect_data_files('ursina'),
+    excludes=['tkinter'],
+    optimize=2,
+)
+pyz = PYZ(a.pure)
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name='MiamiRacer',
+    icon='textures/ursina.ico',
+    console=False,
+)
+coll = COLLECT(exe, a.binaries, a.datas, name='MiamiRacer')